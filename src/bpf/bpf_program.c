@@ -21,6 +21,10 @@
 #include <linux/signal.h>
 #include <uapi/asm/unistd_64.h>
 
+/* Keys into the config map */
+#define CONFIG_BPFBENCH_PID 0
+#define CONFIG_TRACE_PID    1
+
 /* structs below this line -------------------------------------------------- */
 
 struct intermediate_t {
@@ -37,31 +41,45 @@ struct data_t {
 
 BPF_PERCPU_ARRAY(intermediate, struct intermediate_t, 1);
 BPF_PERCPU_ARRAY(syscalls, struct data_t, NUM_SYSCALLS);
+/* Runtime configuration, written by userspace after load */
+BPF_ARRAY(config, u32, 2);
+/* Flags syscall slots that have been touched, so userspace can skip
+ * cold rows when reading results back */
+BPF_ARRAY(active, u8, NUM_SYSCALLS);
 #ifdef FOLLOW
-BPF_HASH(children, u32, u8);
+/* Don't preallocate all 10240 slots for what is usually a handful of
+ * descendants */
+BPF_F_TABLE("hash", u32, u8, children, 10240, BPF_F_NO_PREALLOC);
 #endif
 
 /* helpers below this line -------------------------------------------------- */
 
+static inline u32 config_lookup(int key)
+{
+    u32 *value = config.lookup(&key);
+    return value ? *value : 0;
+}
+
 static inline int do_sysenter(long syscall)
 {
     u64 curr_time = bpf_ktime_get_ns();
     u64 pid_tgid = bpf_get_current_pid_tgid();
-
-/* Maybe filter by PID */
-#if defined(TRACE_PID) && defined(FOLLOW)
     u32 pid = (pid_tgid >> 32);
-    if (pid != TRACE_PID && !children.lookup(&pid)) {
+
+    /* Maybe filter by PID */
+    u32 trace_pid = config_lookup(CONFIG_TRACE_PID);
+#ifdef FOLLOW
+    if (trace_pid && pid != trace_pid && !children.lookup(&pid)) {
         return 0;
     }
-#elif defined(TRACE_PID)
-    if (pid_tgid >> 32 != TRACE_PID) {
+#else
+    if (trace_pid && pid != trace_pid) {
         return 0;
     }
 #endif
 
     /* Don't trace self */
-    if (pid_tgid >> 32 == BPFBENCH_PID) {
+    if (pid == config_lookup(CONFIG_BPFBENCH_PID)) {
         return 0;
     }
 
@@ -95,21 +113,22 @@ static inline int do_sysexit(long syscall, long ret)
     }
 
     u64 pid_tgid = bpf_get_current_pid_tgid();
-
-/* Maybe filter by PID */
-#if defined(TRACE_PID) && defined(FOLLOW)
     u32 pid = (pid_tgid >> 32);
-    if (pid != TRACE_PID && !children.lookup(&pid)) {
+
+    /* Maybe filter by PID */
+    u32 trace_pid = config_lookup(CONFIG_TRACE_PID);
+#ifdef FOLLOW
+    if (trace_pid && pid != trace_pid && !children.lookup(&pid)) {
         return 0;
     }
-#elif defined(TRACE_PID)
-    if (pid_tgid >> 32 != TRACE_PID) {
+#else
+    if (trace_pid && pid != trace_pid) {
         return 0;
     }
 #endif
 
     /* Don't trace self */
-    if (pid_tgid >> 32 == BPFBENCH_PID) {
+    if (pid == config_lookup(CONFIG_BPFBENCH_PID)) {
         return 0;
     }
 
@@ -124,6 +143,10 @@ static inline int do_sysexit(long syscall, long ret)
         }
         data->count++;
         data->overhead += curr_time - start->start_time;
+        u8 *seen = active.lookup((int *)&syscall);
+        if (seen) {
+            *seen = 1;
+        }
     }
     if (start) {
         start->pid_tgid = 0;
@@ -144,7 +167,7 @@ RAW_TRACEPOINT_PROBE(sched_process_fork)
     u32 ppid = p->tgid;
 
     /* Filter ppid */
-    if (ppid != TRACE_PID && !children.lookup(&ppid)) {
+    if (ppid != config_lookup(CONFIG_TRACE_PID) && !children.lookup(&ppid)) {
         return 0;
     }
 
@@ -162,7 +185,7 @@ RAW_TRACEPOINT_PROBE(sched_process_exit)
     u32 pid = (bpf_get_current_pid_tgid() >> 32);
 
     /* Filter ppid */
-    if (pid != TRACE_PID && !children.lookup(&pid)) {
+    if (pid != config_lookup(CONFIG_TRACE_PID) && !children.lookup(&pid)) {
         return 0;
     }
 
@@ -21,18 +21,32 @@ import os, sys
 import atexit
 import time
 import datetime
-import threading
 import signal
-import functools
+import select
+import operator
+import ctypes as ct
 
-from bcc import BPF, syscall
+import numpy as np
 
 from src import defs
 from src.parse_args import parse_args
 from src.utils import syscall_name, drop_privileges, which
 
-signal.signal(signal.SIGINT, lambda x, y: sys.exit())
-signal.signal(signal.SIGTERM, lambda x, y: sys.exit())
+# Structured dtype matching struct data_t in bpf/bpf_program.c
+SYSCALL_DTYPE = np.dtype([('count', np.uint64), ('overhead', np.uint64)])
+
+# Row templates for save_results, parsed once instead of per row
+ROW_FMT = '{name:<22s} {count:>8d} {overhead:>22.3f}{avg_overhead:>22.3f}\n'
+SYSNUM_ROW_FMT = '{sysnum:<3d} ' + ROW_FMT
+
+# Sort key extractors for save_results, keyed by --sort choice
+SORT_KEYS = {
+    'sysname': operator.itemgetter(0),
+    'sysnum': lambda kv: kv[1]['sysnum'],
+    'count': lambda kv: kv[1]['count'],
+    'overhead': lambda kv: kv[1]['overhead'],
+    'avg_overhead': lambda kv: kv[1]['avg_overhead'],
+}
 
 
 class BPFBench:
@@ -44,20 +58,25 @@ class BPFBench:
         self.args = args
         self.bpf = None
         self.start_time = None
-        self.last_checkpoint = None
-        # Maybe get duration
-        try:
-            self.duration = functools.reduce(
-                lambda a, b: a + b, self.args.duration
-            )
-        except TypeError:
-            self.duration = None
-        # Get checkpoint
-        self.checkpoint = functools.reduce(
-            lambda a, b: a + b, self.args.checkpoint
+        # Duration and checkpoint in whole seconds, with timedelta
+        # versions kept for display
+        self.duration_s = args.duration_s
+        self.checkpoint_s = args.checkpoint_s
+        self.duration = (
+            datetime.timedelta(seconds=args.duration_s)
+            if args.duration_s else None
         )
-        # Set should_exit to 0
-        self.should_exit = 0
+        self.checkpoint = datetime.timedelta(seconds=args.checkpoint_s)
+        # Exit pipe; every handled signal writes its number here via
+        # set_wakeup_fd, so the main thread consumes signals from one
+        # place instead of calling sys.exit out of a handler
+        self.exit_r, self.exit_w = os.pipe()
+        os.set_blocking(self.exit_w, False)
+        signal.set_wakeup_fd(self.exit_w)
+        signal.signal(signal.SIGINT, lambda x, y: None)
+        signal.signal(signal.SIGTERM, lambda x, y: None)
+        # Output file, opened once with privileges dropped
+        self.outfile = None
         # Set trace_pid to 0 for now
         self.trace_pid = 0
         # Should sort be reversed?
@@ -65,29 +84,44 @@ class BPFBench:
             self.reverse_sort = 1
         else:
             self.reverse_sort = 0
-        # Timer thread stuff
-        self.timer_thread = threading.Thread(target=self.timer)
-        self.timer_thread.setDaemon(1)
+        # Bind the sort key extractor once
+        try:
+            self.sort_key = SORT_KEYS[self.args.sort]
+        except KeyError:
+            raise ValueError(f'Unable to sort based on {self.args.sort}')
 
     def load_bpf(self):
         """
         Load BPF program.
         """
+        # Deferred so that --help and argument errors return without
+        # paying for the bcc/LLVM import
+        from bcc import BPF, syscall
+
         assert self.bpf is None
 
         flags = []
         # Add BPF_PATH for header includes
         flags.append(f'-I{defs.BPF_PATH}')
         flags.append(f'-DNUM_SYSCALLS={len(syscall.syscalls)}')
-        flags.append(f'-DBPFBENCH_PID={os.getpid()}')
-        if self.trace_pid > 0:
-            flags.append(f'-DTRACE_PID={self.trace_pid}')
-            if self.args.follow:
-                flags.append(f'-DFOLLOW')
+        if self.trace_pid > 0 and self.args.follow:
+            flags.append(f'-DFOLLOW')
+
+        # Precompute the static syscall number -> name table so the
+        # checkpoint path is a plain list index
+        self.name_table = tuple(
+            syscall_name(num) for num in range(len(syscall.syscalls))
+        )
 
         # Load BPF program
         self.bpf = BPF(src_file=f'{defs.BPF_PATH}/bpf_program.c', cflags=flags)
 
+        # PIDs are runtime configuration, not compile-time defines, so
+        # the cflags stay identical from run to run
+        config = self.bpf['config']
+        config[ct.c_int(defs.CONFIG_BPFBENCH_PID)] = ct.c_uint32(os.getpid())
+        config[ct.c_int(defs.CONFIG_TRACE_PID)] = ct.c_uint32(self.trace_pid)
+
         # Register exit hook
         atexit.unregister(self.bpf.cleanup)
         atexit.register(self.on_exit)
@@ -97,96 +131,105 @@ class BPFBench:
         self.save_results()
         print('All done!', file=sys.stderr)
 
-    def timer(self):
-        """
-        Timer for controlling duration and checkpoint.
-        """
-        while 1:
-            curr_time = datetime.datetime.now()
-            if curr_time >= (self.last_checkpoint + self.checkpoint):
-                self.last_checkpoint = curr_time
-                self.save_results()
-            if self.duration and curr_time >= self.duration + self.start_time:
-                self.should_exit = 1
-            time.sleep(1)
-
-    def sort_func(self, v):
-        """
-        Return correct dict value based on sort argument.
-        """
-        if self.args.sort == 'sysname':
-            return v[0]
-        try:
-            return v[1][self.args.sort]
-        except:
-            raise TypeError(f"Unable to sort based on {self.args.sort}")
-
     def get_results(self):
         """
         Get benchmark results.
         """
         results = {}
-        for key, percpu_syscall in self.bpf['syscalls'].iteritems():
-            count = 0
-            overhead = 0.0
-            for syscall in percpu_syscall:
-                count += syscall.count
-                overhead += syscall.overhead
+        table = self.bpf['syscalls']
+        # Pull the entire map in one BPF_MAP_LOOKUP_BATCH syscall where
+        # bcc supports it, falling back to one lookup per key
+        items = None
+        if hasattr(table, 'items_lookup_batch'):
+            try:
+                items = list(table.items_lookup_batch())
+            except Exception:
+                # Kernel predates batched per-CPU map lookups
+                items = None
+        if items is None:
+            # Fetch per-CPU values only for rows the BPF program has
+            # flagged as touched; most syscall slots stay cold
+            active = self.bpf['active']
+            items = []
+            for num in range(len(table)):
+                key = ct.c_int(num)
+                if active[key].value:
+                    items.append((key, table[key]))
+        for key, percpu_syscall in items:
+            # View the per-CPU ctypes array as a NumPy array and reduce,
+            # instead of looping over every CPU slot in Python
+            buf = np.frombuffer(percpu_syscall, dtype=SYSCALL_DTYPE)
+            count = int(buf['count'].sum())
+            overhead = float(buf['overhead'].sum())
             if not count:
                 continue
             # Convert to us from ns
             overhead = overhead / 1e3
-            results[syscall_name(key.value)] = {
-                'sysnum': key.value,
+            sysnum = key.value
+            results[self.name_table[sysnum]] = {
+                'sysnum': sysnum,
                 'count': count,
                 'overhead': overhead,
+                'avg_overhead': overhead / count,
             }
-            # Get average
-            average_overhead = overhead / (count if count else 1)
-            results[syscall_name(key.value)]['avg_overhead'] = average_overhead
         return results
 
     @drop_privileges
+    def open_outfile(self):
+        """
+        Open the output file as the sudoer.
+        """
+        return open(self.args.outfile, 'wb')
+
     def save_results(self):
         """
         Save benchmark results.
         """
         results = self.get_results()
-        f = open(self.args.outfile, 'w') if self.args.outfile else sys.stderr
-        results_str = ''
+        # Collect fragments in a list and join once at the end,
+        # string += would be O(n^2)
+        parts = []
         # Add timestamp
         curr_time = datetime.datetime.now()
-        # String += is O(n^2) in Python, don't try this at home, kids
-        results_str += f'Start time:   {self.start_time}\n'
-        results_str += f'Current time: {curr_time}\n'
-        results_str += f'Time elapsed: {(curr_time - self.start_time)}\n\n'
+        parts.append(f'Start time:   {self.start_time}\n')
+        parts.append(f'Current time: {curr_time}\n')
+        parts.append(f'Time elapsed: {(curr_time - self.start_time)}\n\n')
         # Add header
         if self.args.sysnum:
-            results_str += f'{"NUM":<3s} '
-        results_str += f'{"SYSCALL":<22s} {"COUNT":>8s} {"OVERHEAD(us)":>22s} {"AVG_OVERHEAD(us/call)":>22s}'
-        results_str += '\n'
+            parts.append(f'{"NUM":<3s} ')
+        parts.append(f'{"SYSCALL":<22s} {"COUNT":>8s} {"OVERHEAD(us)":>22s} {"AVG_OVERHEAD(us/call)":>22s}')
+        parts.append('\n')
         # Add results
+        row_fmt = SYSNUM_ROW_FMT if self.args.sysnum else ROW_FMT
         for k, v in sorted(
-            results.items(), key=self.sort_func, reverse=self.reverse_sort
+            results.items(), key=self.sort_key, reverse=self.reverse_sort
         ):
-            if self.args.sysnum:
-                results_str += f'{v["sysnum"]:<3d} '
-            results_str += f'{k:<22s} {v["count"]:>8d} {v["overhead"] :>22.3f}{v["avg_overhead"] :>22.3f}'
-            results_str += '\n'
-        f.write(results_str + '\n')
+            parts.append(row_fmt.format_map({'name': k, **v}))
+        parts.append('\n')
+        # Encode once and issue a single write per destination
+        data = ''.join(parts).encode()
+        if self.outfile:
+            # Rewrite the file from the top on every checkpoint
+            self.outfile.seek(0)
+            self.outfile.truncate()
+            self.outfile.write(data)
+            self.outfile.flush()
+            # One durability barrier per checkpoint; fdatasync is enough
+            # since only the report data matters
+            os.fdatasync(self.outfile.fileno())
+        else:
+            sys.stderr.buffer.write(data)
         if self.args.tee:
-            sys.stderr.write(results_str + '\n')
-        if self.args.outfile:
-            f.close()
+            sys.stderr.buffer.write(data)
 
     def handle_sigchld(self, x, y):
         """
-        Handle SIGCHLD.
+        Handle SIGCHLD. The wakeup fd takes care of notifying the main
+        thread; we only need to reap the child.
         """
         os.wait()
-        self.should_exit = 1
 
-    @drop_privileges
+    @drop_privileges(full=1)
     def run_binary(self, binary, args):
         try:
             binary = which(binary)
@@ -200,6 +243,8 @@ class BPFBench:
         pid = os.fork()
         # Setup traced process
         if pid == 0:
+            # Don't let the child's signals write to the parent's exit pipe
+            signal.set_wakeup_fd(-1)
             signal.pause()
             os.execvp(binary, args)
         # Return pid of traced process
@@ -210,7 +255,11 @@ class BPFBench:
         Run benchmarking.
         """
         self.start_time = datetime.datetime.now()
-        self.last_checkpoint = datetime.datetime.now()
+
+        # Open the output file once, rather than dropping and regaining
+        # privileges on every checkpoint
+        if self.args.outfile:
+            self.outfile = self.open_outfile()
 
         print(
             f'Duration:   {self.duration if self.duration else "Forever"}',
@@ -245,12 +294,27 @@ class BPFBench:
         if self.args.run and self.trace_pid:
             os.kill(self.trace_pid, signal.SIGUSR1)
 
-        # Start the timer
-        self.timer_thread.start()
+        # Single event loop: sleep until the next checkpoint or
+        # end-of-duration deadline, or a byte on the exit pipe.
+        # Deadlines are monotonic seconds, no timedelta arithmetic.
+        now = time.monotonic()
+        next_checkpoint = now + self.checkpoint_s
+        end_time = now + self.duration_s if self.duration_s else None
         while 1:
-            time.sleep(1)
-            if self.should_exit:
+            deadline = next_checkpoint
+            if end_time:
+                deadline = min(deadline, end_time)
+            timeout = max(deadline - time.monotonic(), 0)
+            readable, _, _ = select.select([self.exit_r], [], [], timeout)
+            if readable:
+                os.read(self.exit_r, 1)
+                sys.exit()
+            now = time.monotonic()
+            if end_time and now >= end_time:
                 sys.exit()
+            if now >= next_checkpoint:
+                self.save_results()
+                next_checkpoint += self.checkpoint_s
 
 
 def main():
@@ -24,3 +24,7 @@ PROJECT_PATH = os.path.realpath(os.path.dirname(__file__))
 
 # Path to project/src/bpf
 BPF_PATH = os.path.join(PROJECT_PATH, 'bpf')
+
+# Keys into the BPF config map, must match bpf/bpf_program.c
+CONFIG_BPFBENCH_PID = 0
+CONFIG_TRACE_PID = 1
@@ -20,7 +20,7 @@
 import os, sys
 import argparse
 import datetime
-import re
+import stat
 
 from src.utils import drop_privileges
 
@@ -41,33 +41,22 @@ class ParserTimeDeltaType():
     Arguments of type timedelta.
     Works like the arguments to timeout(1).
     """
-    formats = {
-            'seconds': re.compile(r'^(\d+)[sS]?$'),
-            'minutes': re.compile(r'^(\d+)[mM]$'),
-            'hours': re.compile(r'^(\d+)[hH]$'),
-            'days': re.compile(r'^(\d+)[dD]$'),
-            'weeks': re.compile(r'^(\d+)[wW]$'),
+    # Unit suffix -> multiplier in seconds; a bare number means seconds
+    multipliers = {
+            's': 1,
+            'm': 60,
+            'h': 3600,
+            'd': 86400,
+            'w': 604800,
             }
 
-    def construct_time(self, unit, value):
-        value = int(value)
-        if unit == 'seconds':
-            return datetime.timedelta(seconds=value)
-        if unit == 'minutes':
-            return datetime.timedelta(minutes=value)
-        if unit == 'hours':
-            return datetime.timedelta(hours=value)
-        if unit == 'days':
-            return datetime.timedelta(days=value)
-        if unit == 'weeks':
-            return datetime.timedelta(weeks=value)
-        raise argparse.ArgumentTypeError(f'Unable to construct {unit} with {value}.')
-
     def __call__(self, value):
-        for k, v in self.formats.items():
-            match = v.match(value)
-            if match:
-                return self.construct_time(k, match[1])
+        # Tokens are 2-4 characters; a manual scan beats the regex engine
+        if value.isdigit():
+            return datetime.timedelta(seconds=int(value))
+        multiplier = self.multipliers.get(value[-1:].lower())
+        if multiplier and value[:-1].isdigit():
+            return datetime.timedelta(seconds=int(value[:-1]) * multiplier)
         raise argparse.ArgumentTypeError(f'Invalid specification for time "{value}".')
 
 class ParserNewFileType():
@@ -75,6 +64,11 @@ class ParserNewFileType():
     Arguments of type new file.
     Intelligently prevents user from specifying an invalid path.
     """
+    def __init__(self):
+        # realpath walks and lstats every path component; remember
+        # parents we have already resolved
+        self.realpath_cache = {}
+
     @drop_privileges
     def check_access(self, path):
         """
@@ -82,35 +76,56 @@ class ParserNewFileType():
         NOTE: This is for error prevention, NOT for security.
         We will ALWAYS drop privileges before writing to a file.
         """
-        if os.path.exists(path):
-            return os.access(path, os.W_OK)
-        d, f = os.path.split(path)
+        # One stat decides existence, instead of walking the path for
+        # os.path.exists and again for os.access
         try:
-            d = os.path.realpath(d)
-        except:
-            # Parent dir doesn't exist
+            os.stat(path)
+        except FileNotFoundError:
+            d, f = os.path.split(path)
+            try:
+                d = os.path.realpath(d)
+            except:
+                # Parent dir doesn't exist
+                return False
+            return os.access(d, os.W_OK, effective_ids=True)
+        except OSError:
             return False
-        return os.access(d, os.W_OK)
+        return os.access(path, os.W_OK, effective_ids=True)
 
     def __call__(self, path):
         d, f = os.path.split(path)
         # Make things absolute
+        if d in self.realpath_cache:
+            d = self.realpath_cache[d]
+        else:
+            try:
+                d = self.realpath_cache.setdefault(d, os.path.realpath(d))
+            except:
+                # Parent dir doesn't exist
+                raise argparse.ArgumentTypeError(f'Parent directory {d} does not exist.')
+        # One stat on the parent replaces separate exists/isdir walks
         try:
-            d = os.path.realpath(d)
-        except:
-            # Parent dir doesn't exist
+            if d and not stat.S_ISDIR(os.stat(d).st_mode):
+                raise argparse.ArgumentTypeError(f'{d} is a file.')
+        except OSError:
             raise argparse.ArgumentTypeError(f'Parent directory {d} does not exist.')
-        # Check if parent dir is a dir
-        if d and not os.path.isdir(d):
-            raise argparse.ArgumentTypeError(f'{d} is a file.')
         # Make sure f is not a dir
-        if os.path.isdir(f):
-            raise argparse.ArgumentTypeError(f'{f} is a directory.')
+        try:
+            if stat.S_ISDIR(os.lstat(os.path.join(d, f)).st_mode):
+                raise argparse.ArgumentTypeError(f'{f} is a directory.')
+        except OSError:
+            pass
         if not self.check_access(path):
             raise argparse.ArgumentTypeError(f'No permissions to write to location {d}/{f}.')
         # Join f with new d
         return os.path.join(d, f)
 
+# Shared parser type instances and the precomputed default checkpoint,
+# so building the parser doesn't reconstruct them (or re-parse '30m')
+TIMEDELTA_TYPE = ParserTimeDeltaType()
+NEWFILE_TYPE = ParserNewFileType()
+DEFAULT_CHECKPOINT = [datetime.timedelta(minutes=30)]
+
 def parse_args(sysargs=sys.argv[1:]):
     """
     Argument parsing logic.
@@ -119,17 +134,17 @@ def parse_args(sysargs=sys.argv[1:]):
             formatter_class=argparse.RawTextHelpFormatter)
 
     timings = parser.add_argument_group('timing options')
-    timings.add_argument('-d', '--duration', type=ParserTimeDeltaType(), nargs='+',
+    timings.add_argument('-d', '--duration', type=TIMEDELTA_TYPE, nargs='+',
             help='Duration to run benchmark. Defaults to forever.\n'
             'Supports values like: #[s] #m #h #d #w.\n'
             'Durations can be combined like: 1m 30s.')
-    timings.add_argument('-c', '--checkpoint', type=ParserTimeDeltaType(), default=[ParserTimeDeltaType()('30m')], nargs='+',
+    timings.add_argument('-c', '--checkpoint', type=TIMEDELTA_TYPE, default=DEFAULT_CHECKPOINT, nargs='+',
             help='Interval to checkpoint results. Defaults to 30m.\n'
             'Supports values like: #[s] #m #h #d #w.\n'
             'Durations can be combined like: 1m 30s.')
 
     output = parser.add_argument_group('output options')
-    output.add_argument('-o', '--outfile', type=ParserNewFileType(),
+    output.add_argument('-o', '--outfile', type=NEWFILE_TYPE,
             help="Location to save benchmark data. Overwriting existing files is disabled by default.")
     output.add_argument('--overwrite', action='store_true',
             help='Allow overwriting an existing outfile.')
@@ -155,16 +170,15 @@ def parse_args(sysargs=sys.argv[1:]):
             help=argparse.SUPPRESS)
 
     # Hack to allow arguments to be passed to the analyzed program
-    try:
-        index_of_run = sysargs.index('--run')
-    except ValueError:
-        try:
-            index_of_run = sysargs.index('-r')
-            args = parser.parse_args(sysargs[:index_of_run + 2])
-            vars(args)['runargs'] = sysargs[index_of_run + 1:]
-        except ValueError:
-            args = parser.parse_args(sysargs)
-            vars(args)['runargs'] = []
+    index_of_run = next(
+        (i for i, arg in enumerate(sysargs) if arg in ('-r', '--run')), -1
+    )
+    if index_of_run >= 0:
+        args = parser.parse_args(sysargs[:index_of_run + 2])
+        vars(args)['runargs'] = sysargs[index_of_run + 1:]
+    else:
+        args = parser.parse_args(sysargs)
+        vars(args)['runargs'] = []
 
     # Check for whether follow makes sense
     if args.follow and not (args.run or args.pid):
@@ -186,6 +200,14 @@ def parse_args(sysargs=sys.argv[1:]):
     if os.geteuid() != 0:
         parser.error("This script must be run with root privileges.")
 
+    # Collapse the nargs='+' timedelta lists into whole seconds so the
+    # benchmark loop can work with plain numbers
+    args.duration_s = (
+        int(sum(td.total_seconds() for td in args.duration))
+        if args.duration else None
+    )
+    args.checkpoint_s = int(sum(td.total_seconds() for td in args.checkpoint))
+
     # Check for sudo_uid
     if not os.getenv('SUDO_UID'):
         print('Warning: You should probably run this script with sudo, not via a root shell.', file=sys.stderr)